@@ -15,6 +15,8 @@
 import enum
 import math
 import random
+import shutil
+import tempfile
 
 from automl import parser_util
 
@@ -54,36 +56,50 @@ def _autosplit_example_count(total_example_count):
 class AutoSplitUtil(object):
   """Util to do auto split."""
 
-  def __init__(self, source_lang_code, target_lang_code,
-               total_size, input_paths):
+  def __init__(self, source_lang_code, target_lang_code, input_paths,
+               cache_dir=None, seed=None):
     """Initializes AutoSplitUtil.
 
     Args:
       source_lang_code: String - BCP 47 language code
       target_lang_code: String - BCP 47 language code.
-      total_size: int
       input_paths: [String]
+      cache_dir: String - directory to cache parsed pairs in. Pairs are kept
+        in memory if it is None.
+      seed: int - seed of the random split, a random one is used if None.
     """
     self._source_lang_code = source_lang_code
     self._target_lang_code = target_lang_code
-    self._example_counts = _autosplit_example_count(total_size)
+    # Remaining example counts indexed like `_ML_USES`.
+    self._ml_use_counts = [0] * len(_ML_USES)
+    self._remaining_count = 0
     self._input_paths = input_paths
+    self._cache_dir = cache_dir
+    self._random = random.Random(seed)
 
   def _assign_ml_use(self):
-    """Randomly assign a example type with current split ratio."""
-    # Generate a random number between [0, total_size)
-    example_index = random.randint(0, sum(self._example_counts.values()) - 1)
-    int(random.random() * sum(self._example_counts.values()))
-
-    for ml_use_value in _ML_USES:
-      if example_index < self._example_counts[ml_use_value]:
-        return ml_use_value
-      example_index -= self._example_counts[ml_use_value]
-    return MLUse.TRAIN
-
-  def _select_ml_use(self, ml_use_value):
+    """Randomly assigns an ml_use with the remaining split sizes as weights.
+
+    Each example is drawn without replacement from the remaining split sizes,
+    so the splits are met exactly while the examples are streamed.
+
+    Returns:
+      int - index of the assigned ml_use in `_ML_USES`. Plain list indices
+      keep enum lookups out of the per example loop.
+    """
+    # Generate a random number between [0, remaining_size). Scaling random()
+    # avoids the bit rejection loop of randrange.
+    example_index = int(self._random.random() * self._remaining_count)
+    for ml_use_index, ml_use_count in enumerate(self._ml_use_counts):
+      if example_index < ml_use_count:
+        return ml_use_index
+      example_index -= ml_use_count
+    return 0
+
+  def _select_ml_use(self, ml_use_index):
     """Update the ml_use count which will update the split ratio."""
-    self._example_counts[ml_use_value] -= 1
+    self._ml_use_counts[ml_use_index] -= 1
+    self._remaining_count -= 1
 
   def _create_exporter(self, file_path, output_stream):
     return parser_util.create_exporter(
@@ -92,40 +108,63 @@ class AutoSplitUtil(object):
       dst_lang_code=self._target_lang_code,
       output_stream=output_stream)
 
+  def _read_parallel_phrases(self):
+    """Parses all input files once.
+
+    Returns:
+      (total_count, iterable of (src_text, dst_text)) tuple
+    """
+    if self._cache_dir:
+      total_count, cache_paths = parser_util.cache_parallel_phrases(
+        input_file_paths=self._input_paths,
+        src_lang_code=self._source_lang_code,
+        dst_lang_code=self._target_lang_code,
+        cache_dir=self._cache_dir)
+      return total_count, parser_util.iterate_cached_phrases(cache_paths)
+    # Buffers source and target texts in two parallel lists rather than a
+    # list of tuples, which saves one tuple object per pair.
+    src_texts, dst_texts = [], []
+    for src_text, dst_text in parser_util.parse_input_files(
+        input_file_paths=self._input_paths,
+        src_lang_code=self._source_lang_code,
+        dst_lang_code=self._target_lang_code):
+      src_texts.append(src_text)
+      dst_texts.append(dst_text)
+    return len(src_texts), zip(src_texts, dst_texts)
+
   def autosplit(self, train_output_path, validation_output_path, test_output_path):
     """Autosplits dataset and save to 3 files.
 
+    Input files are parsed only once: the phrase pairs are buffered in memory
+    or in the cache directory so that the split sizes can be computed before
+    any pair is assigned.
+
     Args:
       train_output_path: String
       validation_output_path: String
       test_output_path: String
     """
-    with open(train_output_path, 'w') as train_output_stream, open(validation_output_path,
-                                                                   'w') as validation_output_stream, open(
-      test_output_path, 'w') as test_output_stream:
-      exporters = {
-        MLUse.TRAIN:
-          self._create_exporter(train_output_path, train_output_stream),
-        MLUse.VALIDATION:
-          self._create_exporter(validation_output_path, validation_output_stream),
-        MLUse.TEST:
-          self._create_exporter(test_output_path, test_output_stream),
-      }
-      for exporter in exporters.values():
+    total_count, pairs = self._read_parallel_phrases()
+    example_counts = _autosplit_example_count(total_count)
+    self._ml_use_counts = [example_counts[ml_use_value]
+                           for ml_use_value in _ML_USES]
+    self._remaining_count = total_count
+    with parser_util.open_output_file(train_output_path) as train_output_stream, \
+        parser_util.open_output_file(validation_output_path) as validation_output_stream, \
+        parser_util.open_output_file(test_output_path) as test_output_stream:
+      # Exporters are indexed like `_ML_USES`.
+      exporters = [
+        self._create_exporter(train_output_path, train_output_stream),
+        self._create_exporter(validation_output_path, validation_output_stream),
+        self._create_exporter(test_output_path, test_output_stream),
+      ]
+      for exporter in exporters:
         exporter.initialize()
-      for input_path in self._input_paths:
-        with open(input_path) as input_stream:
-          parser = parser_util.create_parser(
-            file_path=input_path,
-            src_lang_code=self._source_lang_code,
-            dst_lang_code=self._target_lang_code,
-            input_stream=input_stream)
-          for src_text, dst_text in parser:
-            ml_use_value = self._assign_ml_use()
-            exporters[ml_use_value].feed_parallel_phrase_pair(
-              src_text, dst_text)
-            self._select_ml_use(ml_use_value)
-      for exporter in exporters.values():
+      for src_text, dst_text in pairs:
+        ml_use_index = self._assign_ml_use()
+        exporters[ml_use_index].feed_parallel_phrase_pair(src_text, dst_text)
+        self._select_ml_use(ml_use_index)
+      for exporter in exporters:
         exporter.finalize()
 
 
@@ -134,14 +173,17 @@ def autosplit(input_file_paths,
               dst_lang_code,
               train_output_path,
               validation_output_path,
-              test_output_path):
-  total_count = parser_util.iterate_parallel_phrases(input_file_paths=input_file_paths,
-                                                     src_lang_code=src_lang_code,
-                                                     dst_lang_code=dst_lang_code)
-  autosplit_util = AutoSplitUtil(source_lang_code=src_lang_code,
-                                 target_lang_code=dst_lang_code,
-                                 total_size=total_count,
-                                 input_paths=input_file_paths)
-  autosplit_util.autosplit(train_output_path=train_output_path,
-                           validation_output_path=validation_output_path,
-                           test_output_path=test_output_path)
+              test_output_path,
+              seed=None):
+  cache_dir = tempfile.mkdtemp()
+  try:
+    autosplit_util = AutoSplitUtil(source_lang_code=src_lang_code,
+                                   target_lang_code=dst_lang_code,
+                                   input_paths=input_file_paths,
+                                   cache_dir=cache_dir,
+                                   seed=seed)
+    autosplit_util.autosplit(train_output_path=train_output_path,
+                             validation_output_path=validation_output_path,
+                             test_output_path=test_output_path)
+  finally:
+    shutil.rmtree(cache_dir)
@@ -12,9 +12,9 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import mock
 import os
 import unittest
+from unittest import mock
 
 from automl import autosplit as autosplit_util
 
@@ -41,7 +41,6 @@ class AutoSplitUtilTest(unittest.TestCase):
     autosplit = autosplit_util.AutoSplitUtil(
         source_lang_code='en',
         target_lang_code='zh',
-        total_size=100,
         input_paths=[_tmp_file("source.tsv")])
     autosplit.autosplit(
       _tmp_file('target_train.tsv'),
@@ -51,6 +50,37 @@ class AutoSplitUtilTest(unittest.TestCase):
     self.assertEqual(_get_line_count('target_validation.tsv'), 10)
     self.assertEqual(_get_line_count('target_test.tsv'), 10)
 
+  def test_auto_split_util_multiple_inputs(self):
+    _write_tmp_file('source1.tsv', _VALID_TSV)
+    _write_tmp_file('source2.tsv', _VALID_TSV)
+    autosplit_util.autosplit(
+      input_file_paths=[_tmp_file('source1.tsv'), _tmp_file('source2.tsv')],
+      src_lang_code='en',
+      dst_lang_code='zh',
+      train_output_path=_tmp_file('target_train.tsv'),
+      validation_output_path=_tmp_file('target_validation.tsv'),
+      test_output_path=_tmp_file('target_test.tsv'))
+    self.assertEqual(_get_line_count('target_train.tsv'), 160)
+    self.assertEqual(_get_line_count('target_validation.tsv'), 20)
+    self.assertEqual(_get_line_count('target_test.tsv'), 20)
+
+  def test_auto_split_util_seed(self):
+    _write_tmp_file('source.tsv', _VALID_TSV)
+    outputs = []
+    for _ in range(2):
+      autosplit = autosplit_util.AutoSplitUtil(
+          source_lang_code='en',
+          target_lang_code='zh',
+          input_paths=[_tmp_file('source.tsv')],
+          seed=1234)
+      autosplit.autosplit(
+        _tmp_file('target_train.tsv'),
+        _tmp_file('target_validation.tsv'),
+        _tmp_file('target_test.tsv'))
+      with open(_tmp_file('target_test.tsv')) as f:
+        outputs.append(f.read())
+    self.assertEqual(outputs[0], outputs[1])
+
 
 if __name__ == '__main__':
   unittest.main()
\ No newline at end of file
@@ -17,9 +17,7 @@ import os
 from absl import app
 from absl import flags
 from absl import logging
-from builtins import input
 
-from automl import autosplit
 from automl import parser_util
 
 FLAGS = flags.FLAGS
@@ -31,6 +29,10 @@ flags.DEFINE_string('output_file', None, 'The output file.')
 flags.DEFINE_string('train_dataset', None, 'The path of train dataset.')
 flags.DEFINE_string('validation_dataset', None, 'The path of validation dataset.')
 flags.DEFINE_string('test_dataset', None, 'The path of test dataset.')
+flags.DEFINE_integer('seed', None, 'The random seed of autosplit.')
+flags.DEFINE_bool('dedupe', False, 'Whether convert drops repeated sentence pairs.')
+flags.DEFINE_bool('pretty', False, 'Whether convert indents the <tu> elements of tmx output.')
+flags.DEFINE_bool('no_cache', False, 'Whether count ignores the cached counts.')
 
 # Required flag.
 flags.mark_flag_as_required('cmd')
@@ -38,9 +40,17 @@ flags.mark_flag_as_required('input_files')
 flags.mark_flag_as_required('src_lang_code')
 flags.mark_flag_as_required('dst_lang_code')
 
+# Per file counts keyed by path, stored with the file's mtime and size.
+_COUNT_CACHE_PATH = '~/.cache/automl/count.db'
+# Bumped when counting changes, so that counts cached before are recomputed.
+_COUNT_CACHE_VERSION = 2
+
 
 def _get_input_files():
-  return set([os.path.expanduser(path) for path in FLAGS.input_files])
+  # Dedups the paths but keeps their order, so reruns read files in the same
+  # order and produce the same output.
+  return list(dict.fromkeys(
+      os.path.expanduser(path) for path in FLAGS.input_files))
 
 
 def _get_output_file():
@@ -68,13 +78,62 @@ def command_convert():
   parser_util.convert_input_files(input_file_paths=_get_input_files(),
                                   output_file_path=_get_output_file(),
                                   src_lang_code=FLAGS.src_lang_code,
-                                  dst_lang_code=FLAGS.dst_lang_code)
+                                  dst_lang_code=FLAGS.dst_lang_code,
+                                  dedupe=FLAGS.dedupe,
+                                  pretty=FLAGS.pretty)
+
+
+def _count_input_file(input_file_path):
+  return parser_util.iterate_parallel_phrases(input_file_paths=[input_file_path],
+                                              src_lang_code=FLAGS.src_lang_code,
+                                              dst_lang_code=FLAGS.dst_lang_code,
+                                              count_only=True)
+
+
+def _count_input_files(input_file_paths):
+  return sum(_count_input_file(input_file_path)
+             for input_file_path in input_file_paths)
+
+
+def _count_input_files_with_cache(input_file_paths):
+  """Counts sentence pairs, reusing counts of files that did not change.
+
+  Falls back to counting every file if the cache cannot be opened.
+  """
+  import dbm
+  import shelve
+  cache_path = os.path.expanduser(_COUNT_CACHE_PATH)
+  try:
+    cache_dir = os.path.dirname(cache_path)
+    if not os.path.isdir(cache_dir):
+      os.makedirs(cache_dir)
+    cache = shelve.open(cache_path)
+  except (OSError,) + dbm.error as e:
+    logging.warning('Count cache `%s` is not available: %s', cache_path, e)
+    return _count_input_files(input_file_paths)
+  total_count = 0
+  with cache:
+    for input_file_path in input_file_paths:
+      key = os.path.abspath(input_file_path)
+      file_stat = os.stat(input_file_path)
+      file_version = (_COUNT_CACHE_VERSION, file_stat.st_mtime,
+                       file_stat.st_size)
+      cached = cache.get(key, ())
+      if tuple(cached[:3]) == file_version:
+        count = cached[3]
+      else:
+        count = _count_input_file(input_file_path)
+        cache[key] = file_version + (count,)
+      total_count += count
+  return total_count
 
 
 def command_count():
-  total_count = parser_util.iterate_parallel_phrases(input_file_paths=_get_input_files(),
-                                                     src_lang_code=FLAGS.src_lang_code,
-                                                     dst_lang_code=FLAGS.dst_lang_code)
+  """Counts sentence pairs in the input files without validating them."""
+  if FLAGS.no_cache:
+    total_count = _count_input_files(_get_input_files())
+  else:
+    total_count = _count_input_files_with_cache(_get_input_files())
   logging.info('Total parallel phrases count: %d.', total_count)
 
 
@@ -85,18 +144,27 @@ def command_autosplit():
   _assert_flag_not_none('autosplit', 'test_dataset', FLAGS.test_dataset)
   input('Warning: This autosplit feature will randomly split the dataset. It may produce unreliable training result. '
         'Press enter to acknowledge the risk.')
+  from automl import autosplit
   autosplit.autosplit(input_file_paths=_get_input_files(),
                       src_lang_code=FLAGS.src_lang_code,
                       dst_lang_code=FLAGS.dst_lang_code,
                       train_output_path=os.path.expanduser(FLAGS.train_dataset),
                       validation_output_path=os.path.expanduser(FLAGS.validation_dataset),
-                      test_output_path=os.path.expanduser(FLAGS.test_dataset))
+                      test_output_path=os.path.expanduser(FLAGS.test_dataset),
+                      seed=FLAGS.seed)
+
+
+_COMMANDS = {
+  'validate': command_validate,
+  'autosplit': command_autosplit,
+  'convert': command_convert,
+  'count': command_count,
+}
 
 
 def main(argv):
   del argv  # Unused.
-  cmd_key = 'command_{}'.format(FLAGS.cmd)
-  cmd_func = globals().get(cmd_key, None)
+  cmd_func = _COMMANDS.get(FLAGS.cmd, None)
   if not cmd_func:
     logging.fatal('Command `%s` is not supported.', FLAGS.cmd)
   cmd_func()
@@ -0,0 +1,103 @@
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import unittest
+from unittest import mock
+
+from automl import parser
+
+
+def _tmp_file(filename):
+  return os.path.join(os.environ['TEST_TMPDIR'], filename)
+
+
+def _write_tsv(filename, line_count):
+  path = _tmp_file(filename)
+  with open(path, 'w') as f:
+    f.write(''.join('source_{}\ttarget\n'.format(i) for i in range(line_count)))
+  return path
+
+
+class CountCacheTest(unittest.TestCase):
+
+  def setUp(self):
+    cache_dir = _tmp_file('count_cache')
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    self._flags = mock.Mock(input_files=[], src_lang_code='en',
+                            dst_lang_code='zh', no_cache=False)
+    self._count_input_file = mock.Mock(wraps=parser._count_input_file)
+    for patcher in (
+        mock.patch.object(parser, 'FLAGS', self._flags),
+        mock.patch.object(parser, '_COUNT_CACHE_PATH',
+                          os.path.join(cache_dir, 'count.db')),
+        mock.patch.object(parser, '_count_input_file', self._count_input_file)):
+      patcher.start()
+      self.addCleanup(patcher.stop)
+
+  def _count(self, *paths):
+    self._flags.input_files = list(paths)
+    self._count_input_file.reset_mock()
+    with mock.patch.object(parser.logging, 'info') as log_info:
+      parser.command_count()
+    return log_info.call_args[0][1]
+
+  def test_cache_hit(self):
+    path = _write_tsv('cache_hit.tsv', 10)
+    self.assertEqual(self._count(path), 10)
+    self.assertEqual(self._count_input_file.call_count, 1)
+    self.assertEqual(self._count(path), 10)
+    self.assertEqual(self._count_input_file.call_count, 0)
+
+  def test_cache_invalidated_by_size(self):
+    path = _write_tsv('cache_size.tsv', 10)
+    self.assertEqual(self._count(path), 10)
+    _write_tsv('cache_size.tsv', 20)
+    self.assertEqual(self._count(path), 20)
+    self.assertEqual(self._count_input_file.call_count, 1)
+
+  def test_cache_invalidated_by_mtime(self):
+    path = _write_tsv('cache_mtime.tsv', 10)
+    self.assertEqual(self._count(path), 10)
+    file_stat = os.stat(path)
+    os.utime(path, (file_stat.st_atime, file_stat.st_mtime + 10))
+    self.assertEqual(self._count(path), 10)
+    self.assertEqual(self._count_input_file.call_count, 1)
+
+  def test_cache_invalidated_by_version(self):
+    path = _write_tsv('cache_version.tsv', 10)
+    self.assertEqual(self._count(path), 10)
+    with mock.patch.object(parser, '_COUNT_CACHE_VERSION',
+                           parser._COUNT_CACHE_VERSION + 1):
+      self.assertEqual(self._count(path), 10)
+    self.assertEqual(self._count_input_file.call_count, 1)
+
+  def test_no_cache(self):
+    path = _write_tsv('no_cache.tsv', 10)
+    self._flags.no_cache = True
+    self.assertEqual(self._count(path), 10)
+    self.assertEqual(self._count(path), 10)
+    self.assertEqual(self._count_input_file.call_count, 1)
+    self.assertFalse(os.path.exists(_tmp_file('count_cache')))
+
+  def test_unavailable_cache(self):
+    path = _write_tsv('unavailable_cache.tsv', 10)
+    with mock.patch.object(parser, '_COUNT_CACHE_PATH',
+                           os.path.join(path, 'count.db')):
+      self.assertEqual(self._count(path), 10)
+
+
+if __name__ == '__main__':
+  unittest.main()
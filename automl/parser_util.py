@@ -13,11 +13,32 @@
 # limitations under the License.
 
 """Parallel sentence parsers and exporters."""
+import codecs
+import collections
+import csv
+import functools
+import io
+import itertools
+import mmap
+import multiprocessing
+import operator
 import os
+import pickle
+import shutil
+import sys
+import tempfile
 
 from absl import logging
 from lxml import etree
-from six import text_type
+
+
+def _escape_xml_text(text):
+  """Escapes `&`, `<` and `>` in xml character data.
+
+  Same as `xml.sax.saxutils.escape`, which is not used since importing it
+  pulls in `urllib`.
+  """
+  return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
 
 
 def _skip_invalid_tmx_data():
@@ -37,33 +58,29 @@ def _parse_locale(lang_code):
   return lang_code.lower().split('-')[0]
 
 
-def _is_same_language(locale1, locale2):
-  """Compares whether two locacle is the same language."""
-  return locale1 == locale2
+# Compares whether two locales are the same language.
+_is_same_language = operator.eq
 
+# Qualified name of the `xml:lang` attribute as reported by lxml.
+_XML_LANG_ATTR = '{http://www.w3.org/XML/1998/namespace}lang'
 
-def _try_decode(text, encoding='utf-8-sig'):
-  if isinstance(text, text_type):
-    return text
-  try:
-    return text.decode(encoding)
-  except UnicodeError:
-    if encoding == 'utf-8-sig':
-      encoding = 'utf-8'
-    raise ValueError('Invalid file encoding, expect`{}`.'.format(encoding))
 
-
-def _try_encode(text, encoding='utf-8'):
-  if isinstance(text, text_type):
-    return text.encode(encoding)
-  return text
+def _release_element(element):
+  """Frees a parsed lxml element and its preceding siblings."""
+  element.clear()
+  # There seems a weird bug in lxml appengine, always keep 1 element at the
+  # end.
+  while element.getprevious() is not None:
+    del element.getparent()[0]
 
 
 class InvalidFileFormatError(Exception):
   """Exception throws when there is syntactic error."""
 
   def __init__(self, file_type, line_index, message):
-    super(InvalidFileFormatError, self).__init__()
+    # Keeps the arguments so that the error can be pickled back from a parser
+    # process.
+    super(InvalidFileFormatError, self).__init__(file_type, line_index, message)
     if line_index is not None:
       self.message = 'Invalid {} file at line {}: {}'.format(
           file_type, line_index, message)
@@ -84,6 +101,7 @@ class ParallelPhraseParser(object):
 
   Subclasses should implement `next_parallel_phrase_pair` and FILE_FORMAT.
   """
+  # The max number of characters of a phrase.
   _SENTENCE_BUFFER_SIZE = 1024 * 1024
 
   # The max number of skipped phrases in parsing we tolerate, exceeding this
@@ -96,7 +114,6 @@ class ParallelPhraseParser(object):
 
   def __init__(self):
     self._line_index = 0
-    self._next_read_line_index = 0
     # The list stores all skipped phrases which are considered to be invalid by
     # the parser.
     # Each item contains (line number, src_text, dst_text, error_message) so
@@ -145,37 +162,10 @@ class ParallelPhraseParser(object):
     """
     raise NotImplementedError()
 
-  def readline(self, stream, check_sentence_buffer=False, rstrip=True):
-    """Reads one line.
-
-    Args:
-      stream: file stream.
-      check_sentence_buffer: check sentence buffer if it is True.
-      rstrip: strip line separator if it is True.
-    Returns:
-      (One line or _SENTENCE_BUFFER_SIZE buffer, is_eof).
-    Raises:
-      InvalidFileFormatError: if buffer limit exceeded.
-      ParseFinished: if reach eof.
-    """
-    self._line_index = self._next_read_line_index
-    line = stream.readline(self._SENTENCE_BUFFER_SIZE)
-    if not line:
-      raise ParseFinished()
-    if line.endswith('\n') or line.endswith('\n\r'):
-      self._next_read_line_index += 1
-      if check_sentence_buffer and len(line) == self._SENTENCE_BUFFER_SIZE:
-        raise self.invalid_format_error(
-            'Length of the line exceeds the {} characters limit.'.format(
-                self._SENTENCE_BUFFER_SIZE))
-    if rstrip:
-      line = line.rstrip('\n').rstrip('\r').rstrip('\n')
-    return _try_decode(line)
-
   def __iter__(self):
     return self
 
-  def next(self):
+  def __next__(self):
     try:
       return self.next_parallel_phrase_pair()
     except ParseFinished:
@@ -191,8 +181,21 @@ class ParallelPhraseExporter(object):
   """Parser base class to export parallel phrases.
 
   Subclasses should implement `feed_parallel_phrase_pair`, `initialize` and
-  `finalize` is optional.
+  `finalize` is optional. Data should be written with `_write` or
+  `_write_many`, which buffer it and write it to the stream in large chunks.
+  When deduping is enabled, subclasses should skip pairs for which
+  `_is_duplicate` is True.
   """
+  # The number of buffered strings that are joined and written to the stream
+  # at once.
+  _WRITE_BUFFER_SIZE = 4096
+  # The max number of recently exported pairs remembered for deduping.
+  _DEDUPE_CACHE_SIZE = 100000
+
+  def __init__(self, output_stream, dedupe=False):
+    self._output_stream = output_stream
+    self._write_buffer = []
+    self._seen_pairs = collections.OrderedDict() if dedupe else None
 
   def feed_parallel_phrase_pair(self, src, dst):
     raise NotImplementedError()
@@ -201,7 +204,34 @@ class ParallelPhraseExporter(object):
     pass
 
   def finalize(self):
-    pass
+    self._flush()
+
+  def _write(self, data):
+    self._write_buffer.append(data)
+    if len(self._write_buffer) >= self._WRITE_BUFFER_SIZE:
+      self._flush()
+
+  def _write_many(self, data):
+    """Buffers several strings at once, without concatenating them."""
+    self._write_buffer.extend(data)
+    if len(self._write_buffer) >= self._WRITE_BUFFER_SIZE:
+      self._flush()
+
+  def _is_duplicate(self, src, dst):
+    """Returns whether (src, dst) is among the recently exported pairs."""
+    key = (src, dst)
+    if key in self._seen_pairs:
+      self._seen_pairs.move_to_end(key)
+      return True
+    self._seen_pairs[key] = None
+    if len(self._seen_pairs) > self._DEDUPE_CACHE_SIZE:
+      self._seen_pairs.popitem(last=False)
+    return False
+
+  def _flush(self):
+    if self._write_buffer:
+      self._output_stream.write(u''.join(self._write_buffer))
+      del self._write_buffer[:]
 
   def __enter__(self):
     self.initialize()
@@ -211,6 +241,12 @@ class ParallelPhraseExporter(object):
     self.finalize()
 
 
+# The csv field size limit is process wide, so it is raised once at import
+# rather than per parser, and never lowered below a limit set elsewhere.
+if csv.field_size_limit() < ParallelPhraseParser._SENTENCE_BUFFER_SIZE:
+  csv.field_size_limit(ParallelPhraseParser._SENTENCE_BUFFER_SIZE)
+
+
 class TsvParser(ParallelPhraseParser):
   r"""Parser to parse tsv stream.
 
@@ -227,39 +263,58 @@ class TsvParser(ParallelPhraseParser):
     Args:
       src_lang_code: String - source language code in BCP 47 spec.
       dst_lang_code: String - target language code in BCP 47 spec.
-      input_stream: io stream - tsv stream that implemented file interface.
+      input_stream: io stream - tsv text stream that implemented file
+        interface. It should be opened with newline=''.
     """
     super(TsvParser, self).__init__()
     self._src_lang = _parse_locale(src_lang_code)
     self._dst_lang = _parse_locale(dst_lang_code)
     self._tsv_stream = input_stream
+    # The csv reader splits lines in C; quoting is disabled so that quotes are
+    # kept as part of the phrases. Like universal newlines, it ends a line at
+    # `\n`, `\r\n` or a bare `\r`.
+    self._reader = csv.reader(
+        input_stream, delimiter='\t', quoting=csv.QUOTE_NONE)
 
   def next_parallel_phrase_pair(self):
-    line = self.readline(self._tsv_stream, check_sentence_buffer=True)
-    pair = line.split('\t')
-    if len(pair) != 2:
+    try:
+      row = next(self._reader)
+    except StopIteration:
+      raise ParseFinished()
+    except csv.Error as e:
+      raise self.invalid_format_error(str(e))
+    if len(row) != 2:
       raise self.invalid_format_error('Each line can only contain 2 phrases.')
-    return tuple(pair)
+    return row[0], row[1]
+
+  @property
+  def current_line_number(self):
+    # The csv reader counts lines itself, so nothing is tracked per row.
+    return self._reader.line_num
 
 
 class TsvExporter(ParallelPhraseExporter):
   """Exporter to export parallel phrase pair to tsv stream."""
 
-  def __init__(self, src_lang_code, dst_lang_code, output_stream):
+  def __init__(self, src_lang_code, dst_lang_code, output_stream,
+               dedupe=False):
     """Initializes `TsvExporter`.
 
     Args:
       src_lang_code: String - source language code in BCP 47 spec.
       dst_lang_code: String - target language code in BCP 47 spec.
-      output_stream: io stream - tsv stream that implemented file interface.
+      output_stream: io stream - tsv text stream that implemented file
+        interface.
+      dedupe: bool - whether to skip pairs that were recently exported.
     """
+    super(TsvExporter, self).__init__(output_stream, dedupe=dedupe)
     self._src_lang = _parse_locale(src_lang_code)
     self._dst_lang = _parse_locale(dst_lang_code)
-    self._tsv_stream = output_stream
 
   def feed_parallel_phrase_pair(self, src, dst):
-    line = u''.join([src, '\t', dst, '\n'])
-    self._tsv_stream.write(_try_encode(line))
+    if self._seen_pairs is not None and self._is_duplicate(src, dst):
+      return
+    self._write_many((src, u'\t', dst, u'\n'))
 
 
 class TmxParser(ParallelPhraseParser):
@@ -300,7 +355,6 @@ class TmxParser(ParallelPhraseParser):
   """
   FILE_FORMAT = 'TMX'
 
-  _TU_BUF_SIZE = 1024
   _PARENT_TAG_NAME = {
       'tmx': '',
       'header': 'tmx',
@@ -316,81 +370,51 @@ class TmxParser(ParallelPhraseParser):
     Args:
       src_lang_code: String - source language code in BCP 47 spec.
       dst_lang_code: String - target language code in BCP 47 spec.
-      input_stream: io stream - tmx stream that implemented file interface.
+      input_stream: io stream - tmx binary stream that implemented file
+        interface. lxml decodes it as declared in the xml declaration.
     """
     super(TmxParser, self).__init__()
-    self._src_lang = _parse_locale(src_lang_code)
-    self._dst_lang = _parse_locale(dst_lang_code)
+    # Parsed locales are interned, so a matching <tuv> language is the same
+    # object and the equality check short-circuits on identity. Correctness
+    # does not depend on interning.
+    self._src_lang = sys.intern(_parse_locale(src_lang_code))
+    self._dst_lang = sys.intern(_parse_locale(dst_lang_code))
     self._tmx_stream = input_stream
-    self._parser = etree.XMLPullParser(events=('start', 'end'))
-    self._events = self._parser.read_events()
-    self._buffered_parsed_pairs = []
-    self._buffered_pairs_index = 0
-    # Current stack of tag names. It should start with empty string.
-    self._tag_name_stack = ['']
+    # lxml reads and tokenizes the stream in large chunks; only events of the
+    # supported tags reach Python.
+    self._events = etree.iterparse(
+        self._tmx_stream, events=('start', 'end'),
+        tag=tuple(self._PARENT_TAG_NAME), recover=False, huge_tree=False)
     self._header_inited = False
     self._body_inited = False
-    self._encoding = 'utf-8'
+    # Maps raw `xml:lang` values to parsed locales; a file only uses a few.
+    self._tuv_locales = {}
 
   def next_parallel_phrase_pair(self):
-    if len(self._buffered_parsed_pairs) <= self._buffered_pairs_index:
-      self._read_next()
-    pair = self._buffered_parsed_pairs[self._buffered_pairs_index]
-    self._buffered_pairs_index += 1
-    return pair
-
-  def _read_next(self):
-    """Reads and parses parallel phrase pairs from stream.
-
-    It will reset `_buffered_parsed_pairs` and `_buffered_pairs_index`
-    and feeding them with new values.
-
-    Raises:
-      InvalidFileFormatError: If stream format is invalid.
-      ParseFinished: If stream is finished
-    """
-    assert len(self._buffered_parsed_pairs) <= self._buffered_pairs_index
-    buff_total_size = 0
-    self._buffered_pairs_index = 0
-    self._buffered_parsed_pairs = []
     while True:
       try:
-        buff = self.readline(self._tmx_stream, rstrip=False)
-      except ParseFinished:
-        self._parser.close()
-        raise
-      try:
-        self._parser.feed(buff)
+        action, element = next(self._events)
+      except StopIteration:
+        raise ParseFinished()
       except etree.XMLSyntaxError as e:
-        # e.message contains line number info.
-        raise self.invalid_format_error(e.message, show_line_index=False)
-      for action, element in self._events:
-        self._verify_element(action, element.tag)
-        if action == 'end':
-          if element.tag == 'header':
-            self._parse_header_element(element)
-          if element.tag == 'tu':
-            src, dst, error_message = self._parse_tu_element(element)
-            if not error_message:
-              self._buffered_parsed_pairs.append((src, dst))
-            elif _skip_invalid_tmx_data():
-              self._skip_phrase_or_fail_parsing(src, dst, error_message)
-            else:
-              raise self.invalid_format_error(error_message)
-
-            if len(element.getparent()) >= self._TU_BUF_SIZE:
-              # There seems a weird bug in lxml appengine, always keep 1
-              # element at the end.
-              while element.getprevious() is not None:
-                del element.getparent()[0]
-
-      if self._buffered_parsed_pairs:
-        return
-      buff_total_size += len(buff)
-      if buff_total_size > self._SENTENCE_BUFFER_SIZE:
-        raise self.invalid_format_error(
-            'Too many sentence pairs in one line; '
-            'try breaking them into multiple lines.')
+        self._line_index = e.lineno - 1
+        raise self.invalid_format_error(e.msg)
+      if action == 'start':
+        self._verify_element(element)
+        continue
+      if element.tag == 'header':
+        self._parse_header_element(element)
+      elif element.tag == 'tu':
+        src, dst, error_message = self._parse_tu_element(element)
+        _release_element(element)
+        if not error_message:
+          return src, dst
+        # Line numbers are only resolved when they are reported.
+        self._line_index = element.sourceline - 1
+        if _skip_invalid_tmx_data():
+          self._skip_phrase_or_fail_parsing(src, dst, error_message)
+        else:
+          raise self.invalid_format_error(error_message)
 
   def _parse_tu_element(self, tu_element):
     """Parse a <tu> element or skip it on errors.
@@ -402,7 +426,7 @@ class TmxParser(ParallelPhraseParser):
       error message is None
     """
     src, dst = None, None
-    for child_element in tu_element.getchildren():
+    for child_element in tu_element:
       if child_element.tag != 'tuv':
         continue
       text, lang = self._parse_tuv_element(child_element)
@@ -429,14 +453,21 @@ class TmxParser(ParallelPhraseParser):
     Returns:
       (text_in_seg, language_code_without_locale) tuple
     """
-    lang = tuv_element.get('{http://www.w3.org/XML/1998/namespace}lang', None)
+    lang = tuv_element.get(_XML_LANG_ATTR, None)
     if lang:
-      lang = _parse_locale(lang)
+      locale = self._tuv_locales.get(lang)
+      if locale is None:
+        locale = self._tuv_locales[lang] = sys.intern(_parse_locale(lang))
+      lang = locale
     tuv_texts = []
-    for elem in tuv_element.getchildren():
+    for elem in tuv_element:
       if elem.tag == 'seg':
-        tuv_texts.extend(
-            text.strip() for text in elem.itertext() if text.strip())
+        # `strip` returns the same object when there is nothing to strip, so
+        # clean texts are not copied.
+        for text in elem.itertext():
+          text = text.strip()
+          if text:
+            tuv_texts.append(text)
     return ' '.join(tuv_texts), lang
 
   def _skip_phrase_or_fail_parsing(self, src_text, dst_text, error_message):
@@ -456,36 +487,47 @@ class TmxParser(ParallelPhraseParser):
       return
     src_locale = _parse_locale(src_lang)
     if not _is_same_language(src_locale, self._src_lang):
-      raise self.invalid_format_error(
+      raise self._invalid_element_error(
+          element,
           'Language in header doesn\'t match language'
           ' declared. Expecting {}, found {}'.format(self._src_lang,
                                                      src_locale))
 
-  def _verify_element(self, action, tag):
-    """Verifies whether elements' orgnization is valid."""
+  def _verify_element(self, element):
+    """Verifies whether a started element is placed correctly.
+
+    Nesting is checked against the closest supported ancestor in the parsed
+    tree, so no tag stack needs to be maintained; matching end tags are
+    enforced by lxml itself.
+    """
+    tag = element.tag
     if tag not in self._PARENT_TAG_NAME:
       return
-    if action == 'start':
-      if self._tag_name_stack[-1] != self._PARENT_TAG_NAME[tag]:
-        raise self.invalid_format_error(
-            'Invalid tag structure: <%s> should go inside <%s>, not <%s>.' %
-            (tag, self._PARENT_TAG_NAME[tag], self._tag_name_stack[-1]))
-      if tag == 'header':
-        if self._header_inited:
-          raise self.invalid_format_error('Duplicate header tag.')
-        self._header_inited = True
-      if tag == 'body':
-        if self._body_inited:
-          raise self.invalid_format_error('Duplicate body tag.')
-        if not self._header_inited:
-          raise self.invalid_format_error(
-              'The header tag should come before the body tag.')
-      self._tag_name_stack.append(tag)
-    if action == 'end':
-      if self._tag_name_stack[-1] != tag:
-        raise self.invalid_format_error('Unclosed tag {}.'.format(
-            self._tag_name_stack[-1]))
-      self._tag_name_stack.pop()
+    parent = element.getparent()
+    while parent is not None and parent.tag not in self._PARENT_TAG_NAME:
+      parent = parent.getparent()
+    parent_tag = parent.tag if parent is not None else ''
+    if parent_tag != self._PARENT_TAG_NAME[tag]:
+      raise self._invalid_element_error(
+          element,
+          'Invalid tag structure: <%s> should go inside <%s>, not <%s>.' %
+          (tag, self._PARENT_TAG_NAME[tag], parent_tag))
+    if tag == 'header':
+      if self._header_inited:
+        raise self._invalid_element_error(element, 'Duplicate header tag.')
+      self._header_inited = True
+    elif tag == 'body':
+      if self._body_inited:
+        raise self._invalid_element_error(element, 'Duplicate body tag.')
+      if not self._header_inited:
+        raise self._invalid_element_error(
+            element, 'The header tag should come before the body tag.')
+      self._body_inited = True
+
+  def _invalid_element_error(self, element, message):
+    """Creates an `InvalidFileFormatError` at the line of `element`."""
+    self._line_index = element.sourceline - 1
+    return self.invalid_format_error(message)
 
 
 class TmxExporter(ParallelPhraseExporter):
@@ -509,34 +551,59 @@ class TmxExporter(ParallelPhraseExporter):
     </tu>
 """
 
-  def __init__(self, src_lang_code, dst_lang_code, output_stream):
+  _TMX_COMPACT_PAIR_TMPL = (
+      u'<tu><tuv xml:lang="{}"><seg>{}</seg></tuv>'
+      u'<tuv xml:lang="{}"><seg>{}</seg></tuv></tu>\n')
+
+  def __init__(self, src_lang_code, dst_lang_code, output_stream,
+               dedupe=False, pretty=False):
     """Initializes `TmxParser`.
 
     Args:
       src_lang_code: String - source language code in BCP 47 spec.
       dst_lang_code: String - target language code in BCP 47 spec.
-      output_stream: io stream - tmx stream that implemented file interface.
+      output_stream: io stream - tmx text stream that implemented file
+        interface.
+      dedupe: bool - whether to skip pairs that were recently exported.
+      pretty: bool - whether to indent each <tu> over several lines. By
+        default each <tu> is written on a single line.
     """
+    super(TmxExporter, self).__init__(output_stream, dedupe=dedupe)
     self._src_lang = _parse_locale(src_lang_code)
     self._dst_lang = _parse_locale(dst_lang_code)
     self._src_lang_code = src_lang_code
     self._dst_lang_code = dst_lang_code
-    self._tmx_stream = output_stream
+    # Language codes are fixed per exporter, so they are formatted once and
+    # only the texts are interpolated per pair.
+    pair_tmpl = (self._TMX_PAIR_TMPL if pretty
+                 else self._TMX_COMPACT_PAIR_TMPL)
+    self._pair_tmpl = pair_tmpl.format(
+        src_lang_code.replace('%', '%%'), '%s',
+        dst_lang_code.replace('%', '%%'), '%s')
 
   def feed_parallel_phrase_pair(self, src, dst):
-    self._write(
-        self._TMX_PAIR_TMPL.format(self._src_lang_code, src,
-                                   self._dst_lang_code, dst))
+    if self._seen_pairs is not None and self._is_duplicate(src, dst):
+      return
+    self._write(self._pair_tmpl % (_escape_xml_text(src),
+                                   _escape_xml_text(dst)))
 
   def initialize(self):
     self._write(self._TMX_INIT_TMPL.format(self._src_lang_code))
 
   def finalize(self):
     self._write('  </body>\n</tmx>')
+    super(TmxExporter, self).finalize()
 
-  def _write(self, data):
-    self._tmx_stream.write(_try_encode(data))
 
+# Buffer size of input and output files, large enough to amortize a read or
+# write syscall over many lines.
+_IO_BUFFER_SIZE = 1024 * 1024
+# Number of pairs pickled at once into a cache file.
+_CACHE_BATCH_SIZE = 10000
+# Number of bytes read at once when counting lines.
+_COUNT_CHUNK_SIZE = 1024 * 1024
+# Min number of bytes of a tsv shard parsed by its own process.
+_MIN_SHARD_SIZE = 64 * 1024 * 1024
 
 _PARSERS = {
   'tsv': TsvParser,
@@ -557,6 +624,24 @@ def _get_file_type(path):
   return file_type
 
 
+def open_input_file(file_path):
+  """Opens an input file in the mode its parser expects.
+
+  Tsv files are decoded by the io layer, tmx files are opened in binary mode
+  and decoded by lxml.
+  """
+  if _get_file_type(file_path) == 'tmx':
+    return io.open(file_path, 'rb', buffering=_IO_BUFFER_SIZE)
+  return io.open(file_path, 'r', buffering=_IO_BUFFER_SIZE,
+                 encoding='utf-8-sig', newline='')
+
+
+def open_output_file(file_path):
+  """Opens an output file for exporters."""
+  return io.open(file_path, 'w', buffering=_IO_BUFFER_SIZE, encoding='utf-8',
+                 newline='')
+
+
 def create_parser(file_path, *args, **kwargs):
   return _PARSERS[_get_file_type(file_path)](*args, **kwargs)
 
@@ -565,30 +650,419 @@ def create_exporter(file_path, *args, **kwargs):
   return _EXPORTERS[_get_file_type(file_path)](*args, **kwargs)
 
 
-def iterate_parallel_phrases(input_file_paths, src_lang_code, dst_lang_code, exporter=None):
+def _shard_tsv(input_file_path, num_shards):
+  """Splits a tsv file into byte ranges aligned to line boundaries.
+
+  The file is memory mapped, so only the pages around the shard boundaries
+  are read.
+
+  Args:
+    input_file_path: String
+    num_shards: int - the max number of shards.
+  Returns:
+    [(start, end)] - non-empty byte ranges covering the whole file.
+  """
+  with io.open(input_file_path, 'rb') as input_file:
+    size = os.fstat(input_file.fileno()).st_size
+    if not size:
+      return []
+    boundaries = [0]
+    mm = mmap.mmap(input_file.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+      for i in range(1, num_shards):
+        offset = mm.find(b'\n', max(size * i // num_shards, boundaries[-1]))
+        if offset < 0:
+          break
+        boundaries.append(offset + 1)
+    finally:
+      mm.close()
+  boundaries.append(size)
+  return [(start, end) for start, end in zip(boundaries, boundaries[1:])
+          if start < end]
+
+
+def _count_line_ends(input_file, size=None):
+  """Counts line ends like the csv reader: `\r\n`, or a bare `\r` or `\n`.
+
+  Args:
+    input_file: binary file object, positioned at the first byte to scan.
+    size: int - number of bytes to scan, None to scan to the end of file.
+  Returns:
+    (line_end_count, last_byte) tuple
+  """
   total_counts = 0
+  last_byte = b''
+  while size is None or size > 0:
+    chunk = input_file.read(
+        _COUNT_CHUNK_SIZE if size is None else min(size, _COUNT_CHUNK_SIZE))
+    if not chunk:
+      break
+    total_counts += (
+        chunk.count(b'\n') + chunk.count(b'\r') - chunk.count(b'\r\n'))
+    if last_byte == b'\r' and chunk.startswith(b'\n'):
+      # A `\r\n` split between two chunks was counted twice.
+      total_counts -= 1
+    last_byte = chunk[-1:]
+    if size is not None:
+      size -= len(chunk)
+  return total_counts, last_byte
+
+
+def _count_lines_before(input_file_path, offset):
+  """Counts the line ends in the first `offset` bytes of a file."""
+  with io.open(input_file_path, 'rb') as input_file:
+    total_counts, _ = _count_line_ends(input_file, offset)
+  return total_counts
+
+
+def _plan_input_shards(input_file_paths, num_proc):
+  """Splits input files into independently parsable shards.
+
+  Tsv files of at least twice `_MIN_SHARD_SIZE` are split into byte ranges so
+  that a single large file can still be parsed by multiple processes. Tmx
+  files are always parsed as a whole.
+
+  Returns:
+    [(input_file_path, byte_range)] - byte_range is None for a whole file.
+  """
+  shards = []
   for input_file_path in input_file_paths:
-    with open(input_file_path) as input_file:
-      parser = create_parser(file_path=input_file_path,
-                             src_lang_code=src_lang_code,
-                             dst_lang_code=dst_lang_code,
-                             input_stream=input_file)
-      for src, dst in parser:
+    num_shards = 1
+    if _get_file_type(input_file_path) == 'tsv':
+      num_shards = min(num_proc,
+                       os.path.getsize(input_file_path) // _MIN_SHARD_SIZE)
+    if num_shards > 1:
+      shards.extend((input_file_path, byte_range)
+                    for byte_range in _shard_tsv(input_file_path, num_shards))
+    else:
+      shards.append((input_file_path, None))
+  return shards
+
+
+def _iterate_tsv_lines(input_file_path, start, end):
+  """Yields the lines of a line aligned byte range of a tsv file.
+
+  The range is read and decoded in blocks of about `_IO_BUFFER_SIZE` bytes
+  that end at a line boundary, so only one block is in memory at a time.
+  """
+  decoder = codecs.getincrementaldecoder(
+      'utf-8-sig' if start == 0 else 'utf-8')()
+  with io.open(input_file_path, 'rb') as input_file:
+    input_file.seek(start)
+    while start < end:
+      data = input_file.read(min(_IO_BUFFER_SIZE, end - start))
+      if not data.endswith(b'\n'):
+        # Completes the last line; the range itself ends at a line boundary.
+        data += input_file.readline(end - start - len(data))
+      start += len(data)
+      text = decoder.decode(data, final=start >= end)
+      for line in io.StringIO(text, newline=''):
+        yield line
+
+
+def _iterate_input_shard(input_file_path, byte_range, src_lang_code,
+                         dst_lang_code):
+  """Yields parallel phrase pairs of one input file or a byte range of it.
+
+  Args:
+    input_file_path: String
+    byte_range: (start, end) tuple - line aligned byte range of a tsv file, or
+      None to parse the whole file.
+    src_lang_code: String - source language code in BCP 47 spec.
+    dst_lang_code: String - target language code in BCP 47 spec.
+  Yields:
+    (src_text, dst_text) tuple
+  """
+  if byte_range is None:
+    with open_input_file(input_file_path) as input_file:
+      for pair in create_parser(file_path=input_file_path,
+                                src_lang_code=src_lang_code,
+                                dst_lang_code=dst_lang_code,
+                                input_stream=input_file):
+        yield pair
+    return
+  start, end = byte_range
+  parser = TsvParser(src_lang_code=src_lang_code,
+                     dst_lang_code=dst_lang_code,
+                     input_stream=_iterate_tsv_lines(input_file_path, start,
+                                                     end))
+  try:
+    for pair in parser:
+      yield pair
+  except InvalidFileFormatError as e:
+    file_type, line_number, message = e.args
+    if line_number is None or not start:
+      raise
+    # Reports the line number in the whole file rather than in the shard.
+    raise InvalidFileFormatError(
+        file_type, line_number + _count_lines_before(input_file_path, start),
+        message)
+
+
+def _plan_parse(input_file_paths, num_proc):
+  """Plans the input shards and the number of processes parsing them.
+
+  Args:
+    input_file_paths: [String]
+    num_proc: int - number of parser processes, None for the number of input
+      shards capped by the cpu count.
+  Returns:
+    ([(input_file_path, byte_range)], num_proc) tuple
+  """
+  input_shards = _plan_input_shards(
+      input_file_paths, num_proc or multiprocessing.cpu_count())
+  if num_proc is None:
+    num_proc = min(len(input_shards), multiprocessing.cpu_count())
+  return input_shards, num_proc
+
+
+def _count_input_shard(input_shard, src_lang_code, dst_lang_code):
+  """Parses one input shard and returns its number of parallel phrase pairs.
+
+  Only the count is sent back from a worker process, not the parsed texts.
+  """
+  input_file_path, byte_range = input_shard
+  return sum(1 for _ in _iterate_input_shard(
+      input_file_path, byte_range, src_lang_code, dst_lang_code))
+
+
+def _count_parsed_pairs(input_file_paths, src_lang_code, dst_lang_code,
+                        num_proc=None):
+  """Parses and validates all input files, and counts their pairs."""
+  input_shards, num_proc = _plan_parse(input_file_paths, num_proc)
+  count_input_shard = functools.partial(_count_input_shard,
+                                        src_lang_code=src_lang_code,
+                                        dst_lang_code=dst_lang_code)
+  if num_proc <= 1:
+    return sum(map(count_input_shard, input_shards))
+  pool = multiprocessing.Pool(num_proc)
+  try:
+    return sum(pool.imap(count_input_shard, input_shards))
+  finally:
+    pool.terminate()
+    pool.join()
+
+
+def parse_input_files(input_file_paths, src_lang_code, dst_lang_code,
+                      num_proc=None):
+  """Yields parallel phrase pairs of all input files in order.
+
+  With more than one process, input files, and shards of large tsv files, are
+  parsed concurrently in worker processes. Workers cache their pairs in
+  temporary files which are then read back in order, so memory use does not
+  grow with the size of the input files.
+
+  Args:
+    input_file_paths: [String]
+    src_lang_code: String - source language code in BCP 47 spec.
+    dst_lang_code: String - target language code in BCP 47 spec.
+    num_proc: int - number of parser processes, defaults to the number of
+      input shards capped by the cpu count.
+  Yields:
+    (src_text, dst_text) tuple
+  """
+  input_file_paths = list(input_file_paths)
+  input_shards, num_proc = _plan_parse(input_file_paths, num_proc)
+  if num_proc <= 1:
+    for input_file_path in input_file_paths:
+      for pair in _iterate_input_shard(input_file_path, None, src_lang_code,
+                                       dst_lang_code):
+        yield pair
+    return
+  cache_dir = tempfile.mkdtemp()
+  try:
+    _, cache_paths = _cache_input_shards(input_shards, src_lang_code,
+                                         dst_lang_code, cache_dir, num_proc)
+    for pair in iterate_cached_phrases(cache_paths):
+      yield pair
+  finally:
+    shutil.rmtree(cache_dir, ignore_errors=True)
+
+
+def _cache_input_shard(input_shard, src_lang_code, dst_lang_code, cache_path):
+  """Parses one input shard and pickles its pairs into `cache_path`.
+
+  Pairs are pickled in batches of `_CACHE_BATCH_SIZE` so that neither writing
+  nor reading the cache holds the whole shard in memory. Each batch is a
+  ([src_text], [dst_text]) tuple of parallel lists.
+
+  Returns:
+    int - number of cached pairs.
+  """
+  total_counts = 0
+  input_file_path, byte_range = input_shard
+  with open(cache_path, 'wb') as cache_file:
+    src_texts, dst_texts = [], []
+    for src_text, dst_text in _iterate_input_shard(
+        input_file_path, byte_range, src_lang_code, dst_lang_code):
+      src_texts.append(src_text)
+      dst_texts.append(dst_text)
+      if len(src_texts) >= _CACHE_BATCH_SIZE:
+        pickle.dump((src_texts, dst_texts), cache_file,
+                    pickle.HIGHEST_PROTOCOL)
+        total_counts += len(src_texts)
+        # The batch is already serialized, so its lists can be refilled.
+        del src_texts[:]
+        del dst_texts[:]
+    if src_texts:
+      pickle.dump((src_texts, dst_texts), cache_file, pickle.HIGHEST_PROTOCOL)
+      total_counts += len(src_texts)
+  return total_counts
+
+
+def _cache_input_shards(input_shards, src_lang_code, dst_lang_code, cache_dir,
+                        num_proc):
+  """Caches the pairs of each input shard in its own file in `cache_dir`.
+
+  Returns:
+    (total_count, [cache_path]) tuple
+  """
+  cache_paths = [os.path.join(cache_dir, '{}.pkl'.format(i))
+                 for i in range(len(input_shards))]
+  if num_proc <= 1:
+    total_count = sum(
+        _cache_input_shard(input_shard, src_lang_code, dst_lang_code,
+                           cache_path)
+        for input_shard, cache_path in zip(input_shards, cache_paths))
+    return total_count, cache_paths
+  pool = multiprocessing.Pool(num_proc)
+  try:
+    results = [
+        pool.apply_async(_cache_input_shard,
+                         (input_shard, src_lang_code, dst_lang_code,
+                          cache_path))
+        for input_shard, cache_path in zip(input_shards, cache_paths)
+    ]
+    total_count = sum(result.get() for result in results)
+  finally:
+    pool.terminate()
+    pool.join()
+  return total_count, cache_paths
+
+
+def cache_parallel_phrases(input_file_paths, src_lang_code, dst_lang_code,
+                           cache_dir, num_proc=None):
+  """Parses input files once and caches their pairs in `cache_dir`.
+
+  Reading the cache back with `iterate_cached_phrases` is much cheaper than
+  parsing the input files again.
+
+  Args:
+    input_file_paths: [String]
+    src_lang_code: String - source language code in BCP 47 spec.
+    dst_lang_code: String - target language code in BCP 47 spec.
+    cache_dir: String - existing directory to write the cache files to.
+    num_proc: int - number of parser processes, defaults to the number of
+      input shards capped by the cpu count.
+  Returns:
+    (total_count, [cache_path]) tuple
+  """
+  input_shards, num_proc = _plan_parse(input_file_paths, num_proc)
+  return _cache_input_shards(input_shards, src_lang_code, dst_lang_code,
+                             cache_dir, num_proc)
+
+
+def iterate_cached_phrases(cache_paths):
+  """Yields the pairs cached by `cache_parallel_phrases` in order.
+
+  Args:
+    cache_paths: [String]
+  Yields:
+    (src_text, dst_text) tuple
+  """
+  for cache_path in cache_paths:
+    with open(cache_path, 'rb') as cache_file:
+      while True:
+        try:
+          src_texts, dst_texts = pickle.load(cache_file)
+        except EOFError:
+          break
+        for pair in zip(src_texts, dst_texts):
+          yield pair
+
+
+def _count_input_file(input_file_path):
+  """Counts the parallel phrase pairs of one file without validating them.
+
+  Tsv lines are counted on raw bytes, tmx <tu> elements are counted without
+  parsing their content.
+  """
+  total_counts = 0
+  with io.open(input_file_path, 'rb') as input_file:
+    if _get_file_type(input_file_path) == 'tsv':
+      total_counts, last_byte = _count_line_ends(input_file)
+      if last_byte not in (b'', b'\r', b'\n'):
+        # The last line has no line end.
         total_counts += 1
-        if exporter:
-          exporter.feed_parallel_phrase_pair(src, dst)
+    else:
+      try:
+        for _, element in etree.iterparse(input_file, events=('end',),
+                                          tag='tu'):
+          total_counts += 1
+          _release_element(element)
+      except etree.XMLSyntaxError as e:
+        raise InvalidFileFormatError(
+            file_type=TmxParser.FILE_FORMAT, line_index=e.lineno,
+            message=e.msg)
   return total_counts
 
 
+def iterate_parallel_phrases(input_file_paths, src_lang_code, dst_lang_code, exporter=None,
+                             num_proc=None, count_only=False):
+  """Parses all input files and returns the number of parallel phrase pairs.
 
-def convert_input_files(input_file_paths, output_file_path, src_lang_code, dst_lang_code):
-  """Converts the file between tsv/tmx."""
-  with open(output_file_path, 'w') as output_file:
+  Args:
+    input_file_paths: [String]
+    src_lang_code: String - source language code in BCP 47 spec.
+    dst_lang_code: String - target language code in BCP 47 spec.
+    exporter: ParallelPhraseExporter - optional exporter fed with every pair.
+    num_proc: int - number of parser processes.
+    count_only: bool - only counts tsv lines and tmx <tu> elements, which is
+      much faster but does not validate them. Ignored if exporter is set.
+  Returns:
+    int - number of parallel phrase pairs.
+  """
+  if not exporter:
+    if count_only:
+      return sum(_count_input_file(input_file_path)
+                 for input_file_path in input_file_paths)
+    return _count_parsed_pairs(input_file_paths=input_file_paths,
+                               src_lang_code=src_lang_code,
+                               dst_lang_code=dst_lang_code,
+                               num_proc=num_proc)
+  total_counts = 0
+  for src, dst in parse_input_files(input_file_paths=input_file_paths,
+                                    src_lang_code=src_lang_code,
+                                    dst_lang_code=dst_lang_code,
+                                    num_proc=num_proc):
+    total_counts += 1
+    exporter.feed_parallel_phrase_pair(src, dst)
+  return total_counts
+
+
+def convert_input_files(input_file_paths, output_file_path, src_lang_code, dst_lang_code,
+                        dedupe=False, pretty=False):
+  """Converts the file between tsv/tmx.
+
+  If `dedupe` is True, pairs repeating one of the recently exported pairs are
+  dropped from the output. If `pretty` is True, <tu> elements of a tmx output
+  are indented over several lines; it does not affect tsv outputs.
+  """
+  exporter_kwargs = {}
+  if _get_file_type(output_file_path) == 'tmx':
+    exporter_kwargs['pretty'] = pretty
+  with open_output_file(output_file_path) as output_file:
     with create_exporter(file_path=output_file_path,
                          src_lang_code=src_lang_code,
                          dst_lang_code=dst_lang_code,
-                         output_stream=output_file) as exporter:
-      iterate_parallel_phrases(input_file_paths=input_file_paths,
-                               src_lang_code=src_lang_code,
-                               dst_lang_code=dst_lang_code,
-                               exporter=exporter)
+                         output_stream=output_file,
+                         dedupe=dedupe,
+                         **exporter_kwargs) as exporter:
+      pairs = parse_input_files(input_file_paths=input_file_paths,
+                                src_lang_code=src_lang_code,
+                                dst_lang_code=dst_lang_code)
+      # Consumes the pairs without a Python `for` loop; the parser and the
+      # exporter still run Python code for every pair.
+      collections.deque(
+          itertools.starmap(exporter.feed_parallel_phrase_pair, pairs),
+          maxlen=0)
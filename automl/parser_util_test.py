@@ -13,14 +13,18 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import StringIO
+import os
 import unittest
+from unittest import mock
+
+from io import BytesIO
+from io import StringIO
 
 from automl import parser_util
 
 _VALID_TSV = u"""Hello World\t你好世界
 How are you\t你好吗
-""".encode('utf-8')
+"""
 
 _VALID_TMX = u"""<?xml version="1.0" encoding="UTF-8" ?>
 <tmx version="1.4">
@@ -98,24 +102,31 @@ _TMX_WITH_ERRORS = u"""<?xml version="1.0" encoding="UTF-8" ?>
 """.encode('utf-8')
 
 
+def _write_tmp_file(filename, content):
+  path = os.path.join(os.environ['TEST_TMPDIR'], filename)
+  with open(path, 'wb') as f:
+    f.write(content)
+  return path
+
+
 class ParserUtilTest(unittest.TestCase):
 
   def test_parse_and_export_valid_tsv_tmx(self):
-    tsv_input_stream1 = StringIO.StringIO(_VALID_TSV)
-    tmx_output_stream1 = StringIO.StringIO()
+    tsv_input_stream1 = StringIO(_VALID_TSV)
+    tmx_output_stream1 = StringIO()
     tsv_parser1 = parser_util.TsvParser('en', 'zh', tsv_input_stream1)
     tmx_exporter1 = parser_util.TmxExporter('en', 'zh', tmx_output_stream1)
     self._convert(tsv_parser1, tmx_exporter1)
     tmx_output1 = tmx_output_stream1.getvalue()
 
-    tmx_input_stream2 = StringIO.StringIO(tmx_output1)
-    tsv_output_stream2 = StringIO.StringIO()
+    tmx_input_stream2 = BytesIO(tmx_output1.encode('utf-8'))
+    tsv_output_stream2 = StringIO()
     tmx_parser2 = parser_util.TmxParser('en', 'zh', tmx_input_stream2)
     tsv_exporter2 = parser_util.TsvExporter('en', 'zh', tsv_output_stream2)
     self._convert(tmx_parser2, tsv_exporter2)
 
     tsv_output_stream2.seek(0)
-    tmx_output_stream3 = StringIO.StringIO()
+    tmx_output_stream3 = StringIO()
     tsv_parser3 = parser_util.TsvParser('en', 'zh', tsv_output_stream2)
     tmx_exporter3 = parser_util.TmxExporter('en', 'zh', tmx_output_stream3)
     self._convert(tsv_parser3, tmx_exporter3)
@@ -123,72 +134,236 @@ class ParserUtilTest(unittest.TestCase):
     self.assertEqual(tmx_output1, tmx_output3)
 
   def test_parse_empty_tsv(self):
-    tsv_input_stream1 = StringIO.StringIO('')
-    tmx_output_stream1 = StringIO.StringIO()
+    tsv_input_stream1 = StringIO('')
+    tmx_output_stream1 = StringIO()
     tsv_parser1 = parser_util.TsvParser('en', 'zh', tsv_input_stream1)
     tmx_exporter1 = parser_util.TmxExporter('en', 'zh', tmx_output_stream1)
     self._convert(tsv_parser1, tmx_exporter1)
 
-    tmx_output_stream1.seek(0)
-    tsv_output_stream2 = StringIO.StringIO()
-    tmx_parser2 = parser_util.TmxParser('en', 'zh', tmx_output_stream1)
+    tmx_input_stream2 = BytesIO(tmx_output_stream1.getvalue().encode('utf-8'))
+    tsv_output_stream2 = StringIO()
+    tmx_parser2 = parser_util.TmxParser('en', 'zh', tmx_input_stream2)
     tsv_exporter2 = parser_util.TsvExporter('en', 'zh', tsv_output_stream2)
     self._convert(tmx_parser2, tsv_exporter2)
     self.assertEqual(tsv_output_stream2.getvalue(), '')
 
   def test_parse_and_export_valid_tmx_tsv(self):
-    tmx_input_stream1 = StringIO.StringIO(_VALID_TMX)
-    tsv_output_stream1 = StringIO.StringIO()
+    tmx_input_stream1 = BytesIO(_VALID_TMX)
+    tsv_output_stream1 = StringIO()
     tmx_parser1 = parser_util.TmxParser('en', 'zh', tmx_input_stream1)
     tsv_exporter1 = parser_util.TsvExporter('en', 'zh', tsv_output_stream1)
     self._convert(tmx_parser1, tsv_exporter1)
     tsv_output1 = tsv_output_stream1.getvalue()
 
-    tsv_input_stream2 = StringIO.StringIO(tsv_output1)
-    tmx_output_stream2 = StringIO.StringIO()
+    tsv_input_stream2 = StringIO(tsv_output1)
+    tmx_output_stream2 = StringIO()
     tsv_parser2 = parser_util.TsvParser('en', 'zh', tsv_input_stream2)
     tmx_exporter2 = parser_util.TmxExporter('en', 'zh', tmx_output_stream2)
     self._convert(tsv_parser2, tmx_exporter2)
 
-    tmx_output_stream2.seek(0)
-    tsv_output_stream3 = StringIO.StringIO()
-    tmx_parser3 = parser_util.TmxParser('en', 'zh', tmx_output_stream2)
+    tmx_input_stream3 = BytesIO(tmx_output_stream2.getvalue().encode('utf-8'))
+    tsv_output_stream3 = StringIO()
+    tmx_parser3 = parser_util.TmxParser('en', 'zh', tmx_input_stream3)
     tsv_exporter3 = parser_util.TsvExporter('en', 'zh', tsv_output_stream3)
     self._convert(tmx_parser3, tsv_exporter3)
     tsv_output3 = tsv_output_stream3.getvalue()
     self.assertEqual(tsv_output1, tsv_output3)
 
+  def test_export_tmx_escapes_text(self):
+    tmx_output_stream = StringIO()
+    tmx_exporter = parser_util.TmxExporter('en', 'zh', tmx_output_stream)
+    with tmx_exporter:
+      tmx_exporter.feed_parallel_phrase_pair(u'<b> & </b>', u'你好 & 世界')
+    tmx_input_stream = BytesIO(tmx_output_stream.getvalue().encode('utf-8'))
+    tmx_parser = parser_util.TmxParser('en', 'zh', tmx_input_stream)
+    self.assertEqual([(u'<b> & </b>', u'你好 & 世界')], list(tmx_parser))
+
+  def test_export_pretty_tmx(self):
+    tmx_outputs = []
+    for pretty in (False, True):
+      tsv_parser = parser_util.TsvParser('en', 'zh', StringIO(_VALID_TSV))
+      tmx_output_stream = StringIO()
+      tmx_exporter = parser_util.TmxExporter('en', 'zh', tmx_output_stream,
+                                             pretty=pretty)
+      self._convert(tsv_parser, tmx_exporter)
+      tmx_outputs.append(tmx_output_stream.getvalue())
+    compact_tmx, pretty_tmx = tmx_outputs
+    self.assertLess(len(compact_tmx), len(pretty_tmx))
+    tmx_pairs = [
+        list(parser_util.TmxParser('en', 'zh', BytesIO(tmx.encode('utf-8'))))
+        for tmx in tmx_outputs]
+    self.assertEqual(tmx_pairs[0], tmx_pairs[1])
+    self.assertEqual(2, len(tmx_pairs[0]))
+
+  def test_convert_pretty_tmx(self):
+    tsv_path = _write_tmp_file('pretty.tsv', _VALID_TSV.encode('utf-8'))
+    tmx_path = os.path.join(os.environ['TEST_TMPDIR'], 'pretty.tmx')
+    # Compact output has both <tuv> of a <tu> on one line.
+    for pretty, tuv_line_count in ((False, 2), (True, 4)):
+      parser_util.convert_input_files([tsv_path], tmx_path, 'en', 'zh',
+                                      pretty=pretty)
+      with open(tmx_path, 'rb') as f:
+        tmx_lines = f.read().splitlines()
+      self.assertEqual(sum(b'<tuv' in line for line in tmx_lines),
+                       tuv_line_count)
+
+  def test_export_tsv_dedupe(self):
+    tsv_input_stream = StringIO(_VALID_TSV * 3)
+    tsv_output_stream = StringIO()
+    tsv_parser = parser_util.TsvParser('en', 'zh', tsv_input_stream)
+    tsv_exporter = parser_util.TsvExporter('en', 'zh', tsv_output_stream,
+                                           dedupe=True)
+    self._convert(tsv_parser, tsv_exporter)
+    self.assertEqual(_VALID_TSV, tsv_output_stream.getvalue())
+
   def test_parse_valid_tsv(self):
-    tsv_input_stream1 = StringIO.StringIO(_VALID_TSV)
+    tsv_input_stream1 = StringIO(_VALID_TSV)
     tsv_parser1 = parser_util.TsvParser('en', 'zh', tsv_input_stream1)
     pair1, pair2 = list(tsv_parser1)
     self.assertEqual(pair1, ('Hello World', u'你好世界'))
     self.assertEqual(pair2, ('How are you', u'你好吗'))
 
+  def test_invalid_tsv(self):
+    tsv_input_stream = StringIO('Hello\t你好\nWorld\n')
+    tsv_parser = parser_util.TsvParser('en', 'zh', tsv_input_stream)
+
+    with self.assertRaisesRegex(
+        parser_util.InvalidFileFormatError,
+        r'Invalid TSV file at line 2: Each line can only contain 2 phrases'):
+      list(tsv_parser)
+
+  def test_parse_tsv_line_endings(self):
+    tsv_input_stream = StringIO(u'a\tb\r\nc\td\re\tf\n', newline='')
+    tsv_parser = parser_util.TsvParser('en', 'zh', tsv_input_stream)
+    self.assertEqual([('a', 'b'), ('c', 'd'), ('e', 'f')], list(tsv_parser))
+
+    # A bare `\r` ends the line, so it cannot be part of a phrase.
+    tsv_input_stream = StringIO(u'a\tb\nc\rd\te\n', newline='')
+    tsv_parser = parser_util.TsvParser('en', 'zh', tsv_input_stream)
+    with self.assertRaisesRegex(
+        parser_util.InvalidFileFormatError,
+        r'Invalid TSV file at line 2: Each line can only contain 2 phrases'):
+      list(tsv_parser)
+
   def test_parse_valid_tmx(self):
-    tmx_input_stream1 = StringIO.StringIO(_VALID_TMX)
+    tmx_input_stream1 = BytesIO(_VALID_TMX)
     tmx_parser1 = parser_util.TmxParser('en', 'zh', tmx_input_stream1)
     pair, = list(tmx_parser1)
     self.assertEqual(pair, ('Hello World', u'你好 世界'))
 
+  def test_count_only(self):
+    tsv_path = _write_tmp_file('count.tsv', _VALID_TSV.encode('utf-8'))
+    tmx_path = _write_tmp_file('count.tmx', _VALID_TMX)
+    self.assertEqual(
+        parser_util.iterate_parallel_phrases(
+            [tsv_path, tmx_path], 'en', 'zh', count_only=True),
+        parser_util.iterate_parallel_phrases([tsv_path, tmx_path], 'en', 'zh'))
+
+    # Like the parser, counts `\r\n` once and a bare `\r` as a line end,
+    # including when they are split between read chunks.
+    tsv_path = _write_tmp_file('count_crlf.tsv',
+                               b'a\tb\rc\td\r\ne\tf\r\ng\th\ri\tj')
+    with mock.patch.object(parser_util, '_COUNT_CHUNK_SIZE', 4):
+      self.assertEqual(
+          parser_util.iterate_parallel_phrases([tsv_path], 'en', 'zh',
+                                               count_only=True), 5)
+    self.assertEqual(
+        parser_util.iterate_parallel_phrases([tsv_path], 'en', 'zh'), 5)
+
+  def test_count_only_malformed_tmx(self):
+    tmx_path = _write_tmp_file('count_malformed.tmx',
+                               b"""<tmx>\n<body>\n<tu>""")
+    with self.assertRaisesRegex(
+        parser_util.InvalidFileFormatError, r'Invalid TMX file at line 3: '):
+      parser_util.iterate_parallel_phrases([tmx_path], 'en', 'zh',
+                                           count_only=True)
+
+  def test_parse_multiple_files_in_processes(self):
+    tsv_path = _write_tmp_file('multi.tsv', _VALID_TSV.encode('utf-8'))
+    tmx_path = _write_tmp_file('multi.tmx', _VALID_TMX)
+    input_paths = [tsv_path, tmx_path, tsv_path]
+    self.assertEqual(
+        list(parser_util.parse_input_files(input_paths, 'en', 'zh', num_proc=2)),
+        list(parser_util.parse_input_files(input_paths, 'en', 'zh', num_proc=1)))
+    self.assertEqual(
+        parser_util.iterate_parallel_phrases(input_paths, 'en', 'zh',
+                                             num_proc=2), 5)
+
+  def test_shard_tsv(self):
+    content = b''.join(b'source_%d\ttarget_%d\n' % (i, i) for i in range(100))
+    tsv_path = _write_tmp_file('shard.tsv', content)
+    byte_ranges = parser_util._shard_tsv(tsv_path, 3)
+    self.assertEqual(len(byte_ranges), 3)
+    self.assertEqual(byte_ranges[0][0], 0)
+    self.assertEqual(byte_ranges[-1][1], len(content))
+    for (_, end), (start, _) in zip(byte_ranges, byte_ranges[1:]):
+      self.assertEqual(end, start)
+      self.assertEqual(content[end - 1:end], b'\n')
+
+  @mock.patch.object(parser_util, '_MIN_SHARD_SIZE', 64)
+  @mock.patch.object(parser_util, '_IO_BUFFER_SIZE', 50)
+  def test_parse_sharded_tsv(self):
+    content = u''.join(u'源_{}\ttarget_{}\n'.format(i, i) for i in range(100))
+    tsv_path = _write_tmp_file('sharded.tsv', content.encode('utf-8'))
+    self.assertEqual(
+        list(parser_util.parse_input_files([tsv_path], 'en', 'zh', num_proc=4)),
+        list(parser_util.parse_input_files([tsv_path], 'en', 'zh', num_proc=1)))
+
+    tsv_path = _write_tmp_file('sharded_invalid.tsv',
+                               (content + u'invalid\n').encode('utf-8'))
+    with self.assertRaisesRegex(
+        parser_util.InvalidFileFormatError,
+        r'Invalid TSV file at line 101: Each line can only contain 2 phrases'):
+      list(parser_util.parse_input_files([tsv_path], 'en', 'zh', num_proc=4))
+
+    # Bare `\r` line ends before the invalid shard are counted like the
+    # parser counts them.
+    content = u''.join(u'源_{}\ttarget_{}{}'.format(i, i, u'\r\n\r'[i % 3])
+                       for i in range(100))
+    tsv_path = _write_tmp_file('sharded_invalid_cr.tsv',
+                               (content + u'invalid\n').encode('utf-8'))
+    with self.assertRaisesRegex(
+        parser_util.InvalidFileFormatError,
+        r'Invalid TSV file at line 101: Each line can only contain 2 phrases'):
+      list(parser_util.parse_input_files([tsv_path], 'en', 'zh', num_proc=4))
+
   def _convert(self, parser, exporter):
     with exporter:
       for src, dst in parser:
         exporter.feed_parallel_phrase_pair(src, dst)
 
   def test_invalid_tmx(self):
-    tmx_input_stream = StringIO.StringIO("""<tmx><tu></tu></tmx>""")
+    tmx_input_stream = BytesIO(b"""<tmx><tu></tu></tmx>""")
     tmx_parser = parser_util.TmxParser('en', 'zh', tmx_input_stream)
 
-    with self.assertRaisesRegexp(
+    with self.assertRaisesRegex(
         parser_util.InvalidFileFormatError,
         r'Invalid TMX file at line 1: Invalid tag structure'):
       list(tmx_parser)
 
+  def test_malformed_tmx(self):
+    tmx_input_stream = BytesIO(b"""<tmx>\n<header srclang="en">\n</tmx>""")
+    tmx_parser = parser_util.TmxParser('en', 'zh', tmx_input_stream)
+
+    with self.assertRaisesRegex(
+        parser_util.InvalidFileFormatError,
+        r'Invalid TMX file at line 3: Opening and ending tag mismatch'):
+      list(tmx_parser)
+
+  def test_duplicate_tmx_body(self):
+    tmx_input_stream = BytesIO(
+        b"""<tmx><header srclang="en" /><body></body><body></body></tmx>""")
+    tmx_parser = parser_util.TmxParser('en', 'zh', tmx_input_stream)
+
+    with self.assertRaisesRegex(
+        parser_util.InvalidFileFormatError,
+        r'Invalid TMX file at line 1: Duplicate body tag'):
+      list(tmx_parser)
+
   def test_parse_tmx_with_error_no_skip(self):
-    tmx_input = StringIO.StringIO(_TMX_WITH_ERRORS)
+    tmx_input = BytesIO(_TMX_WITH_ERRORS)
     tmx_parser = parser_util.TmxParser('en', 'zh', tmx_input)
-    with self.assertRaisesRegexp(
+    with self.assertRaisesRegex(
         parser_util.InvalidFileFormatError,
         r'No sentence found in source and target languages'):
       list(tmx_parser)